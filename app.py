@@ -1,127 +1,835 @@
+import io
 import os
-import uuid
-import json
-import inspect
+import time
+import shutil
+import secrets
+import hashlib
+import mimetypes
+import tempfile
+import subprocess
+import sys
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+# Cap native thread pools before numpy/TensorFlow load; they would otherwise size
+# themselves to every logical CPU on top of Streamlit's own threads
+for _var in ("OMP_NUM_THREADS", "TF_NUM_INTRAOP_THREADS"):
+    os.environ.setdefault(_var, str(max(1, (os.cpu_count() or 2) // 2)))
+os.environ.setdefault("TF_NUM_INTEROP_THREADS", "1")
+
+import numpy as np
+import orjson
 import streamlit as st
-from pydub import AudioSegment
-import yt_dlp
-from music21 import converter
 
-# Try importing basic-pitch entry points
-PREDICT_FN = None
-PREDICT_AND_SAVE_FN = None
-IMPORT_ERROR = None
-try:
-    from basic_pitch.inference import predict, predict_and_save
 
-    PREDICT_FN = predict
-    PREDICT_AND_SAVE_FN = predict_and_save
-except ImportError as e:
+# Import basic-pitch's note post-processing. It pulls in onnxruntime/TensorFlow/CoreML,
+# so this happens on first use (once per process) rather than before the page renders
+@st.cache_resource(show_spinner=False)
+def load_basic_pitch():
     try:
-        from basic_pitch.inference import predict_and_save
+        from basic_pitch import note_creation
 
-        PREDICT_AND_SAVE_FN = predict_and_save
-    except Exception:
-        pass
+        return note_creation, None
+    except ImportError as e:
+        return None, e
+
+
+def physical_cores() -> int:
     try:
-        from basic_pitch.inference import predict
+        import psutil
+
+        return psutil.cpu_count(logical=False) or os.cpu_count() or 1
+    except ImportError:
+        return max(1, (os.cpu_count() or 2) // 2)
+
+
+# Execution providers for DEVICE: the accelerators it allows that this onnxruntime
+# build has (CoreML on Apple Silicon, CUDA), always followed by the CPU fallback
+def ort_providers(coreml_units: str = "ALL") -> list:
+    import onnxruntime as ort
+
+    available = ort.get_available_providers()
+    providers = []
+    if DEVICE in ("auto", "coreml") and "CoreMLExecutionProvider" in available:
+        # MLProgram runs fp16 on the Neural Engine; let the GPU accumulate in fp16 as well
+        coreml_opts = {"ModelFormat": "MLProgram", "MLComputeUnits": coreml_units, "AllowLowPrecisionAccumulationOnGPU": "1"}
+        providers.append(("CoreMLExecutionProvider", coreml_opts))
+    if DEVICE in ("auto", "cuda") and "CUDAExecutionProvider" in available:
+        providers.append(("CUDAExecutionProvider", {"device_id": CUDA_DEVICE_ID}))
+    providers.append("CPUExecutionProvider")
+    return providers
+
+
+# Tag for model files derived from the installed packages, so upgrading basic-pitch,
+# onnx or onnxruntime builds fresh ones instead of loading stale graphs
+def model_tag() -> str:
+    return hashlib.blake2b(cache_version("basic-pitch", "onnx", "onnxruntime").encode(), digest_size=6).hexdigest()
+
+
+# ONNX Runtime session with full graph optimizations, shared across reruns. On CPU the
+# hardware-independent fusions are saved to MODELS on first start so later starts skip
+# that pass
+@st.cache_resource(show_spinner=False)
+def get_ort_session(model_path: str, coreml_units: str = "ALL"):
+    import onnxruntime as ort
+
+    providers = ort_providers(coreml_units)
+    on_cpu = providers == ["CPUExecutionProvider"]
+    stem = Path(model_path).name.removesuffix(".onnx")
+    # a pre-optimized graph shipped next to the model (see scripts/) wins over our own.
+    # Models written to MODELS (the int8 copy) already carry the tag
+    tag = "" if Path(model_path).parent == MODELS else f".{model_tag()}"
+    shipped = Path(model_path).with_name(f"{stem}.opt.onnx")
+    opt_path = shipped if tag and shipped.exists() else MODELS / f"{stem}{tag}.opt.onnx"
+    # fused CPU contrib ops in the saved graph would not map onto CoreML/CUDA
+    if on_cpu and not opt_path.exists():
+        # written under a private name and moved into place, so a crash or a concurrent
+        # start never leaves a truncated graph behind
+        tmp_path = opt_path.with_name(f"{opt_path.name}.{secrets.token_hex(4)}.tmp")
+        try:
+            so = ort.SessionOptions()
+            so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+            so.optimized_model_filepath = str(tmp_path)
+            ort.InferenceSession(model_path, sess_options=so, providers=["CPUExecutionProvider"])
+            tmp_path.replace(opt_path)
+        except Exception:
+            pass  # e.g. read-only disk; optimize in memory instead
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+    so = ort.SessionOptions()
+    so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    # one thread per physical core; hyperthreads only add contention for conv kernels
+    so.intra_op_num_threads = physical_cores()
+    so.inter_op_num_threads = 1
+    so.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    if on_cpu and opt_path.exists():
+        try:
+            return ort.InferenceSession(str(opt_path), sess_options=so, providers=providers)
+        except Exception:
+            if opt_path.parent == MODELS:
+                opt_path.unlink(missing_ok=True)  # unreadable graph; rebuilt on the next start
+    return ort.InferenceSession(model_path, sess_options=so, providers=providers)
+
+
+# Int8 (dynamic, per-channel) copy of the ONNX model. Prefer the artifact built by
+# scripts/export_basic_pitch_onnx.py; otherwise quantize once and reuse
+@st.cache_resource(show_spinner=False)
+def get_int8_model_path(fp32_path: str) -> str:
+    if (ARTIFACTS / "basic_pitch.int8.onnx").exists():
+        return str(ARTIFACTS / "basic_pitch.int8.onnx")
+    # tagged like the optimized graphs, so a package upgrade quantizes afresh
+    q_path = MODELS / f"basic_pitch.int8.{model_tag()}.onnx"
+    if not q_path.exists():
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        tmp_path = q_path.with_name(f"{q_path.name}.{secrets.token_hex(4)}.tmp")
+        try:
+            quantize_dynamic(fp32_path, str(tmp_path), per_channel=True, weight_type=QuantType.QInt8)
+            tmp_path.replace(q_path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+    return str(q_path)
+
+
+# Load the basic-pitch model once per process instead of on every predict() call
+@st.cache_resource(show_spinner=False)
+def get_bp_model(coreml_units: str = "ALL"):
+    from basic_pitch import ICASSP_2022_MODEL_PATH, ONNX_PRESENT, FilenameSuffix, build_icassp_2022_model_path
+    from basic_pitch.inference import Model
+
+    if ONNX_PRESENT:
+        # basic-pitch ships an ONNX export of the same model; run it through our
+        # tuned session instead of the default one Model() creates
+        onnx_path = str(build_icassp_2022_model_path(FilenameSuffix.onnx))
+        # int8 kernels are CPU-only; with an accelerator keep the fp32 graph on-device
+        if QUANTIZE_MODEL and len(ort_providers()) == 1:
+            try:
+                onnx_path = get_int8_model_path(onnx_path)
+            except Exception:
+                pass  # quantization unavailable; stay on the fp32 model
+        # skip Model.__init__, which would probe every backend and build (then throw
+        # away) a default session; predict() only needs model_type and model
+        model = Model.__new__(Model)
+        model.model_type = Model.MODEL_TYPES.ONNX
+        model.model = get_ort_session(onnx_path, coreml_units)
+        return model
+    model = Model(ICASSP_2022_MODEL_PATH)
+    if model.model_type == Model.MODEL_TYPES.TFLITE:
+        # the default interpreter runs single-threaded
+        model.interpreter = type(model.interpreter)(str(ICASSP_2022_MODEL_PATH), num_threads=physical_cores())
+        model.model = model.interpreter.get_signature_runner()
+    return model
+
+
+# Worker pool for model inference so it runs off the Streamlit script thread;
+# onnxruntime releases the GIL, so requests from different sessions overlap
+@st.cache_resource(show_spinner=False)
+def get_executor():
+    return ThreadPoolExecutor(max_workers=min(4, os.cpu_count() or 1))
+
+
+# Small pool for MusicXML/PDF rendering, so a clip's score doesn't queue behind the
+# inference jobs of every other clip on the main executor
+@st.cache_resource(show_spinner=False)
+def get_render_executor():
+    return ThreadPoolExecutor(max_workers=2)
+
+
+# Load the model in the background as soon as a session opens, so it is ready by the
+# time the user has picked a file (or the YouTube download finishes)
+def warm_up_model(coreml_units: str = "ALL"):
+    key = f"model_warm_up_{coreml_units}"
+    if key not in st.session_state:
+        st.session_state[key] = get_executor().submit(get_bp_model, coreml_units)
+
+
+# True when the ONNX session can run on CoreML (Apple Silicon, PIANO_DEVICE auto/coreml)
+@st.cache_resource(show_spinner=False)
+def coreml_available() -> bool:
+    try:
+        import onnxruntime as ort
+    except ImportError:
+        return False
+    return DEVICE in ("auto", "coreml") and "CoreMLExecutionProvider" in ort.get_available_providers()
+
+
+# Content hash of one version of a file; cached on mtime so reruns don't re-read the audio
+@st.cache_data(show_spinner=False)
+def hash_file(path: str, mtime: float) -> str:
+    return hashlib.blake2b(Path(path).read_bytes(), digest_size=16).hexdigest()
+
+
+def file_digest(path: Path) -> str:
+    return hash_file(str(path), path.stat().st_mtime)
 
-        PREDICT_FN = predict
+
+# Read a clip straight into a float32 array instead of letting basic-pitch run it through
+# librosa.load again. ffmpeg output is already mono 22.05 kHz; uploads libsndfile could
+# read as-is are downmixed/resampled here
+def load_audio(path: str) -> np.ndarray:
+    import soundfile as sf
+
+    audio, sr = sf.read(path, dtype="float32", always_2d=False)
+    if audio.ndim == 2:
+        # a mat-vec downmix; mean(axis=1) walks the interleaved frames far more slowly
+        audio = audio @ np.full(audio.shape[1], 1 / audio.shape[1], dtype=np.float32)
+    if sr != SAMPLE_RATE:
+        import soxr
+
+        # soxr directly: the same HQ filter librosa.resample uses, without importing librosa
+        audio = soxr.resample(audio, sr, SAMPLE_RATE, "HQ")
+    return audio
+
+
+# Number of overlapping model windows basic-pitch splits n_samples of audio into
+def window_count(n_samples: int) -> int:
+    from basic_pitch.constants import AUDIO_N_SAMPLES, FFT_HOP
+
+    overlap_len = N_OVERLAP_FRAMES * FFT_HOP
+    return -(-(n_samples + overlap_len // 2) // (AUDIO_N_SAMPLES - overlap_len))
+
+
+# basic-pitch's run_inference() for an in-memory signal: overlapping 2 s windows through
+# the model, then the overlapping frames are cropped and the windows stitched back
+def run_model(audio: np.ndarray, model) -> dict[str, np.ndarray]:
+    from basic_pitch.constants import ANNOTATIONS_FPS, AUDIO_N_SAMPLES, FFT_HOP
+    from basic_pitch.inference import Model
+
+    overlap_len = N_OVERLAP_FRAMES * FFT_HOP
+    hop = AUDIO_N_SAMPLES - overlap_len
+    n_windows = window_count(len(audio))
+    padded = np.zeros((n_windows - 1) * hop + AUDIO_N_SAMPLES, dtype=np.float32)
+    padded[overlap_len // 2 : overlap_len // 2 + len(audio)] = audio
+    windows = np.lib.stride_tricks.sliding_window_view(padded, AUDIO_N_SAMPLES)[::hop, :, np.newaxis]
+    # ONNX takes any batch size, so run many windows per call; the other backends get one.
+    # CoreML compiles per input shape, so its calls are padded to one fixed batch: the
+    # window count of a CLIP_SECONDS excerpt, which then runs in a single call
+    batch, fixed_shape = 1, False
+    if model.model_type == Model.MODEL_TYPES.ONNX:
+        providers = model.model.get_providers()
+        fixed_shape = "CoreMLExecutionProvider" in providers
+        if fixed_shape:
+            batch = window_count(CLIP_SECONDS * SAMPLE_RATE)
+        else:
+            batch = PREDICT_BATCH if providers == ["CPUExecutionProvider"] else ACCEL_PREDICT_BATCH
+    # one input buffer reused for every call; only the model outputs grow with the clip
+    buf = np.zeros((batch if fixed_shape else min(batch, n_windows), AUDIO_N_SAMPLES, 1), dtype=np.float32)
+    outputs: dict[str, list] = {"note": [], "onset": [], "contour": []}
+    for start in range(0, n_windows, batch):
+        n = min(batch, n_windows - start)
+        buf[:n] = windows[start : start + n]
+        if fixed_shape and n < len(buf):
+            buf[n:] = 0
+        for key, value in model.predict(buf if fixed_shape else buf[:n]).items():
+            outputs[key].append(value[:n])
+    n_frames = int(np.floor(len(audio) * ANNOTATIONS_FPS / SAMPLE_RATE))
+    trim = N_OVERLAP_FRAMES // 2
+    return {
+        key: np.concatenate(chunks)[:, trim:-trim, :].reshape(-1, chunks[0].shape[-1])[:n_frames]
+        for key, chunks in outputs.items()
+    }
+
+
+# Same defaults as basic_pitch.inference.predict()
+def transcribe(audio: np.ndarray, model):
+    from basic_pitch.constants import FFT_HOP
+
+    note_creation, _ = load_basic_pitch()
+    min_note_len = int(np.round(127.70 / 1000 * (SAMPLE_RATE / FFT_HOP)))
+    return note_creation.model_output_to_notes(
+        run_model(audio, model),
+        onset_thresh=0.5,
+        frame_thresh=0.3,
+        min_note_len=min_note_len,
+        melodia_trick=True,
+        midi_tempo=120,
+    )
+
+
+# Version tag for the disk caches below: CACHE_VERSION plus the installed versions of the
+# packages that produce the output. st.cache_data only hashes the decorated function's
+# own source, so changes to the helpers it calls must bump CACHE_VERSION
+@st.cache_resource(show_spinner=False)
+def cache_version(*packages: str) -> str:
+    from importlib import metadata
+
+    tags = [str(CACHE_VERSION)]
+    for name in packages:
+        try:
+            tags.append(f"{name}=={metadata.version(name)}")
+        except metadata.PackageNotFoundError:
+            tags.append(f"{name} missing")
+    return ",".join(tags)
+
+
+# Transcription results keyed by audio content hash (the path argument is not
+# hashed), so re-running the same audio is a disk-cache lookup instead of a forward pass.
+# The device and CoreML compute units are part of the key: fp16 on the GPU/Neural
+# Engine gives slightly different activations, and so different notes, than CPU
+@st.cache_data(show_spinner=False, persist="disk")
+def run_basic_pitch(audio_digest: str, quantized: bool, version: str, device: str, coreml_units: str, _audio_path: str) -> tuple[bytes, list]:
+    midi_data, note_events = transcribe(load_audio(_audio_path), get_bp_model(coreml_units))
+    buf = io.BytesIO()
+    midi_data.write(buf)
+    return buf.getvalue(), note_events
+
+
+# MusicXML is cached by MIDI content hash. The default writer below builds the score
+# straight from the MIDI notes; music21's full import/layout is opt-in since it is
+# by far the slowest post-inference step
+@st.cache_data(show_spinner=False, persist="disk")
+def midi_to_musicxml(midi_digest: str, advanced_layout: bool, version: str, _midi_path: str, _note_events: list) -> bytes:
+    if advanced_layout:
+        with tempfile.TemporaryDirectory() as tmp:
+            xml_path = Path(tmp) / "score.musicxml"
+            music21_convert(_midi_path, str(xml_path))
+            return xml_path.read_bytes()
+    return note_events_to_musicxml(_note_events)
+
+
+# music21 runs in one long-lived worker process: its heavy import is paid once per
+# server, and parsing doesn't compete for the GIL with the app's threads. Jobs are
+# tab-separated path pairs on stdin; music21's own prints go to stderr
+MUSIC21_WORKER = """
+import sys
+from music21 import converter
+out, sys.stdout = sys.stdout, sys.stderr
+for line in sys.stdin:
+    midi_path, xml_path = line.rstrip("\\n").split("\\t")
+    try:
+        converter.parse(midi_path).write("musicxml", fp=xml_path)
+        reply = "ok"
+    except Exception as e:
+        reply = f"error {e!r}".replace("\\n", " ")
+    print(reply, file=out, flush=True)
+"""
+
+
+def start_music21_worker() -> tuple[subprocess.Popen, queue.Queue]:
+    proc = subprocess.Popen(
+        [sys.executable, "-c", MUSIC21_WORKER], stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True
+    )
+    # replies are read on a daemon thread so a job can wait on them with a deadline;
+    # None marks the worker's exit
+    replies = queue.Queue()
+
+    def pump():
+        for line in proc.stdout:
+            replies.put(line.strip())
+        replies.put(None)
+
+    threading.Thread(target=pump, daemon=True).start()
+    return proc, replies
+
+
+# The shared worker and the lock that serializes its jobs. A worker that died or hung
+# is replaced in place while the lock is held, so no two jobs ever talk to one process
+@st.cache_resource(show_spinner=False)
+def get_music21_worker() -> dict:
+    proc, replies = start_music21_worker()
+    return {"proc": proc, "replies": replies, "lock": threading.Lock()}
+
+
+def restart_music21_worker(worker: dict):
+    worker["proc"].kill()
+    worker["proc"].wait()
+    worker["proc"], worker["replies"] = start_music21_worker()
+
+
+def music21_convert(midi_path: str, xml_path: str):
+    worker = get_music21_worker()
+    with worker["lock"]:
+        if worker["proc"].poll() is not None:
+            restart_music21_worker(worker)
+        try:
+            worker["proc"].stdin.write(f"{Path(midi_path).resolve()}\t{Path(xml_path).resolve()}\n")
+            worker["proc"].stdin.flush()
+            reply = worker["replies"].get(timeout=MUSIC21_TIMEOUT)
+        except queue.Empty:
+            restart_music21_worker(worker)
+            raise TimeoutError(f"music21 did not finish within {MUSIC21_TIMEOUT}s")
+        except OSError:
+            reply = None  # broken pipe: the worker died before reading the job
+        if reply is None:
+            restart_music21_worker(worker)
+            raise RuntimeError("music21 worker exited")
+    if reply != "ok":
+        raise RuntimeError(reply.removeprefix("error "))
+
+
+# PDF engraving through MuseScore's CLI, when it is installed (it's optional). Runs
+# headless, so Qt gets the offscreen platform
+@st.cache_data(show_spinner=False, persist="disk")
+def musicxml_to_pdf(xml_digest: str, version: str, _xml_path: str) -> bytes:
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf_path = Path(tmp) / "score.pdf"
+        try:
+            subprocess.run(
+                [MUSESCORE, "-o", str(pdf_path), str(Path(_xml_path).resolve())],
+                capture_output=True,
+                check=True,
+                timeout=120,
+                env={**os.environ, "QT_QPA_PLATFORM": "offscreen"},
+            )
+        except subprocess.CalledProcessError as e:
+            raise RuntimeError(f"MuseScore failed: {e.stderr.decode(errors='replace').strip()}") from e
+        return pdf_path.read_bytes()
+
+
+# Start MuseScore once per process in the background, so its binary and Qt libraries are
+# already in the page cache when the first PDF export runs
+@st.cache_resource(show_spinner=False)
+def warm_up_musescore():
+    return get_render_executor().submit(
+        subprocess.run,
+        [MUSESCORE, "--version"],
+        capture_output=True,
+        timeout=60,
+        env={**os.environ, "QT_QPA_PLATFORM": "offscreen"},
+    )
+
+
+# Lightweight MusicXML writer: notes are quantized to a sixteenth-note grid at a
+# fixed tempo and laid out on a grand staff (split at middle C), one voice per staff
+STEPS = [("C", 0), ("C", 1), ("D", 0), ("D", 1), ("E", 0), ("F", 0), ("F", 1), ("G", 0), ("G", 1), ("A", 0), ("A", 1), ("B", 0)]
+# duration in sixteenths -> (note type, dots)
+NOTE_TYPES = {16: ("whole", 0), 12: ("half", 1), 8: ("half", 0), 6: ("quarter", 1), 4: ("quarter", 0), 3: ("eighth", 1), 2: ("eighth", 0), 1: ("16th", 0)}
+MUSICXML_HEADER = (
+    b'<?xml version="1.0" encoding="UTF-8"?>\n'
+    b'<!DOCTYPE score-partwise PUBLIC "-//Recordare//DTD MusicXML 3.1 Partwise//EN" '
+    b'"http://www.musicxml.org/dtds/partwise.dtd">\n'
+)
+
+
+def split_duration(dur: int) -> list[int]:
+    parts = []
+    for size in NOTE_TYPES:
+        while dur >= size:
+            parts.append(size)
+            dur -= size
+    return parts
+
+
+def staff_measures(notes: list[tuple[int, int, int]], measure_len: int, n_measures: int) -> list[list]:
+    # Notes sharing an onset form one chord lasting until the next onset (or until its
+    # longest note ends); gaps become rests
+    chords: dict[int, tuple[set, int]] = {}
+    for on, off, pitch in notes:
+        pitches, end = chords.setdefault(on, (set(), 0))
+        pitches.add(pitch)
+        chords[on] = (pitches, max(end, off))
+    onsets = sorted(chords)
+    events, cursor = [], 0
+    for i, on in enumerate(onsets):
+        if on > cursor:
+            events.append((cursor, on, ()))
+        pitches, end = chords[on]
+        if i + 1 < len(onsets):
+            end = min(end, onsets[i + 1])
+        events.append((on, end, tuple(sorted(pitches))))
+        cursor = end
+    if cursor < n_measures * measure_len:
+        events.append((cursor, n_measures * measure_len, ()))
+
+    # Split events at barlines and into notatable durations, tying the pieces of a note
+    measures = [[] for _ in range(n_measures)]
+    for start, end, pitches in events:
+        pos = start
+        while pos < end:
+            seg_end = min(end, (pos // measure_len + 1) * measure_len)
+            for dur in split_duration(seg_end - pos):
+                tie_stop = bool(pitches) and pos > start
+                tie_start = bool(pitches) and pos + dur < end
+                measures[pos // measure_len].append((dur, pitches, tie_stop, tie_start))
+                pos += dur
+    return measures
+
+
+def note_xml(dur: int, pitch: int | None, staff: int, chord: bool, tie_stop: bool, tie_start: bool) -> str:
+    parts = ["<note>"]
+    if chord:
+        parts.append("<chord />")
+    if pitch is None:
+        parts.append("<rest />")
+    else:
+        step, alter = STEPS[pitch % 12]
+        alter_xml = f"<alter>{alter}</alter>" if alter else ""
+        parts.append(f"<pitch><step>{step}</step>{alter_xml}<octave>{pitch // 12 - 1}</octave></pitch>")
+    parts.append(f"<duration>{dur}</duration>")
+    ties = (["stop"] if tie_stop else []) + (["start"] if tie_start else [])
+    parts.extend(f'<tie type="{tie}" />' for tie in ties)
+    note_type, dots = NOTE_TYPES[dur]
+    parts.append(f"<voice>{staff}</voice><type>{note_type}</type>{'<dot />' * dots}<staff>{staff}</staff>")
+    if ties:
+        parts.append("<notations>" + "".join(f'<tied type="{tie}" />' for tie in ties) + "</notations>")
+    parts.append("</note>")
+    return "".join(parts)
+
+
+# Works straight off basic-pitch's (start_s, end_s, pitch, amplitude, bends) tuples,
+# so the MIDI written for download never has to be parsed back in. The markup is
+# joined from string fragments; an ElementTree build spent most of its time serializing
+def note_events_to_musicxml(note_events: list, tempo: float = 120.0, ts: tuple[int, int] = (4, 4)) -> bytes:
+    sixteenth = 60.0 / tempo / 4
+    measure_len = ts[0] * 16 // ts[1]
+    staves: dict[int, list] = {1: [], 2: []}
+    for start, end, pitch, *_ in note_events:
+        on = int(round(start / sixteenth))
+        off = max(on + 1, int(round(end / sixteenth)))
+        staves[1 if pitch >= 60 else 2].append((on, off, int(pitch)))
+    total = max((off for notes in staves.values() for _, off, _ in notes), default=0)
+    n_measures = max(1, -(-total // measure_len))
+    layout = {staff: staff_measures(notes, measure_len, n_measures) for staff, notes in staves.items()}
+
+    out = [
+        '<score-partwise version="3.1"><part-list><score-part id="P1"><part-name>Piano</part-name>'
+        '</score-part></part-list><part id="P1">'
+    ]
+    for m in range(n_measures):
+        out.append(f'<measure number="{m + 1}">')
+        if m == 0:
+            out.append(
+                "<attributes><divisions>4</divisions><key><fifths>0</fifths></key>"
+                f"<time><beats>{ts[0]}</beats><beat-type>{ts[1]}</beat-type></time><staves>2</staves>"
+                '<clef number="1"><sign>G</sign><line>2</line></clef>'
+                '<clef number="2"><sign>F</sign><line>4</line></clef></attributes>'
+                f'<direction placement="above"><direction-type><words>q = {tempo:g}</words></direction-type>'
+                f'<sound tempo="{tempo:g}" /></direction>'
+            )
+        for staff in (1, 2):
+            if staff == 2:
+                out.append(f"<backup><duration>{measure_len}</duration></backup>")
+            for dur, pitches, tie_stop, tie_start in layout[staff][m]:
+                if not pitches:
+                    out.append(note_xml(dur, None, staff, False, False, False))
+                for i, pitch in enumerate(pitches):
+                    out.append(note_xml(dur, pitch, staff, i > 0, tie_stop, tie_start))
+        out.append("</measure>")
+    out.append("</part></score-partwise>")
+    return MUSICXML_HEADER + "".join(out).encode()
+
+
+# Note events as one column per field (Feather/Arrow), so downstream code can work on
+# contiguous arrays instead of iterating (start, end, pitch, amplitude, bends) tuples
+def write_note_events_feather(note_events: list, path: Path):
+    import pyarrow as pa
+    import pyarrow.feather as feather
+
+    starts, ends, pitches, amps, bends = zip(*note_events) if note_events else ((),) * 5
+    table = pa.table(
+        {
+            "start": pa.array(starts, pa.float64()),
+            "end": pa.array(ends, pa.float64()),
+            "pitch": pa.array(pitches, pa.int16()),
+            "amplitude": pa.array(amps, pa.float32()),
+            "pitch_bends": pa.array(bends, pa.list_(pa.int32())),
+        }
+    )
+    feather.write_feather(table, str(path))
+
+
+# orjson serializes numpy scalars/arrays natively, in C
+JSON_OPTS = orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+# Download payloads, kept in session_state and re-read only when the file changes
+# (st.cache_data would unpickle a fresh copy of the bytes on every rerun). Grouped by
+# clip uid so the payloads of clips no longer shown can be dropped
+def download_data(path: Path, uid: str) -> bytes:
+    mtime = path.stat().st_mtime
+    files = st.session_state.setdefault("download_bytes", {}).setdefault(uid, {})
+    cached = files.get(path)
+    if cached is None or cached[0] != mtime:
+        cached = files[path] = (mtime, path.read_bytes())
+    return cached[1]
+
+
+# True if libsndfile can decode the file (WAV/FLAC/OGG, and MP3 with libsndfile >= 1.1)
+def soundfile_readable(path: Path) -> bool:
+    import soundfile as sf
+
+    try:
+        sf.info(str(path))
+        return True
     except Exception:
-        pass
-    if not (PREDICT_FN or PREDICT_AND_SAVE_FN):
-        IMPORT_ERROR = e
-
-# Utility to sanitize for JSON (convert numpy scalars etc.)
-def sanitize(obj):
-    if isinstance(obj, dict):
-        return {k: sanitize(v) for k, v in obj.items()}
-    if isinstance(obj, list):
-        return [sanitize(v) for v in obj]
+        return False
+
+
+# A YoutubeDL for one request. It isn't thread-safe, so every request gets its own and
+# sessions never wait on each other's extraction or download; the per-request output
+# name keeps concurrent downloads of the same video apart
+def make_ydl(uid: str):
+    import yt_dlp
+
+    ydl_opts = {
+        "format": "bestaudio/best",
+        "outtmpl": str(UPLOADS / f"{uid}_raw.%(ext)s"),
+        "quiet": True,
+        "no_warnings": True,
+        # keep the native Opus/M4A stream; ffmpeg decodes it straight to WAV
+        "postprocessors": [],
+        # fetch only the excerpt we transcribe instead of the whole track
+        "download_ranges": yt_dlp.utils.download_range_func(None, [(0, CLIP_SECONDS)]),
+        "retries": 3,
+        "fragment_retries": 3,
+    }
+    return yt_dlp.YoutubeDL(ydl_opts)
+
+
+# Decode audio straight to mono 22.05 kHz WAV, basic-pitch's native rate,
+# in a single ffmpeg process
+def ffmpeg_to_wav(src: Path | str, dst: Path, start: float = 0.0, duration: float | None = None, headers: dict | None = None):
+    cmd = ["ffmpeg", "-nostdin", "-y", "-loglevel", "error"]
+    if headers:
+        cmd += ["-headers", "".join(f"{k}: {v}\r\n" for k, v in headers.items())]
+    if duration is not None:
+        # input-side seek/limit: only the requested span is demuxed and decoded
+        cmd += ["-ss", str(start), "-t", str(duration)]
+    # decode the first audio stream only: cover art in MP3/M4A uploads and the video
+    # track of a "best" (non audio-only) YouTube format are never touched
+    cmd += ["-i", str(src), "-map", "0:a:0", "-vn", "-sn", "-dn", "-ac", "1", "-ar", str(SAMPLE_RATE), "-c:a", "pcm_s16le", "-f", "wav", str(dst)]
     try:
-        import numpy as _np
+        subprocess.run(cmd, capture_output=True, check=True)
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"ffmpeg failed: {e.stderr.decode(errors='replace').strip()}") from e
 
-        if isinstance(obj, (_np.generic,)):
-            return obj.item()
-    except ImportError:
-        pass
-    if isinstance(obj, (int, float, str, bool)) or obj is None:
-        return obj
-    return str(obj)
+
+# Bump when transcription or score output changes, to invalidate the on-disk caches
+CACHE_VERSION = 1
+
+# Directories. Uploads/outputs are scratch data and can be moved to a RAM disk, e.g.
+# PIANO_TMPDIR=/dev/shm/piano on hosts with slow network-attached storage
+SCRATCH = Path(os.environ.get("PIANO_TMPDIR", "."))
+UPLOADS = SCRATCH / "uploads"
+OUTPUTS = SCRATCH / "outputs"
+MODELS = Path("models")
+ARTIFACTS = Path("artifacts")
+
+
+# Working directories are created once per process rather than on every rerun
+@st.cache_resource(show_spinner=False)
+def init_dirs():
+    for d in (UPLOADS, OUTPUTS, MODELS):
+        d.mkdir(parents=True, exist_ok=True)
 
 
-# Directories
-UPLOADS = Path("uploads")
-OUTPUTS = Path("outputs")
-for d in (UPLOADS, OUTPUTS):
-    d.mkdir(exist_ok=True)
+init_dirs()
+
+# Length of the YouTube excerpt that gets transcribed
+CLIP_SECONDS = 30
+
+# basic-pitch's input rate and the frame overlap between its analysis windows
+SAMPLE_RATE = 22050
+N_OVERLAP_FRAMES = 30
+PREDICT_BATCH = 8  # windows per ONNX call on CPU (~2 s of audio each)
+ACCEL_PREDICT_BATCH = 32  # windows per call on CUDA (CoreML uses a CLIP_SECONDS batch)
+
+# Seconds one music21 conversion may take before its worker is killed and restarted
+MUSIC21_TIMEOUT = 60
+
+# MuseScore executable for PDF export (None hides the PDF download)
+MUSESCORE = next(filter(None, map(shutil.which, ("mscore", "musescore", "mscore4portable", "MuseScore4"))), None)
+
+# Inference device: auto (best available), coreml, cuda or cpu
+DEVICE = os.environ.get("PIANO_DEVICE", "auto").lower()
+CUDA_DEVICE_ID = int(os.environ.get("PIANO_CUDA_DEVICE", "0"))
+# CoreML compute units offered on Apple Silicon (label -> MLComputeUnits)
+COREML_UNITS = {"All": "ALL", "Neural Engine": "CPUAndNeuralEngine", "GPU": "CPUAndGPU"}
+
+# Set PIANO_QUANTIZE=1 to run the int8 model. Off by default: without VNNI the dynamic
+# int8 convs are several times slower than fp32, and they add spurious notes
+QUANTIZE_MODEL = os.environ.get("PIANO_QUANTIZE", "0") == "1"
 
 st.set_page_config(page_title="AI Piano Arranger", layout="wide")
 st.title("🎹 AI Piano Arranger")
 st.write("Upload a short audio file or paste a YouTube link. We'll generate a solo piano arrangement as sheet music!")
 
+# every input goes through ffmpeg (decode/trim), so fail up front if it's missing
+if shutil.which("ffmpeg") is None:
+    st.error("❌ ffmpeg was not found on PATH. Install it (e.g. `brew install ffmpeg` or `apt install ffmpeg`) and restart the app.")
+    st.stop()
+
+coreml_units = "ALL"
+if coreml_available():
+    coreml_units = COREML_UNITS[st.selectbox("Accelerator", list(COREML_UNITS))]
+warm_up_model(coreml_units)
+if MUSESCORE:
+    warm_up_musescore()
+
 input_type = st.radio("Select input type:", ["Upload File", "YouTube Link"])
-audio_path: Path | None = None
+# (decoded audio, uid, display name) for every clip to transcribe on this run
+clips: list[tuple[Path, str, str]] = []
 
 if input_type == "Upload File":
-    uploaded = st.file_uploader("Upload audio (WAV/MP3/etc.)", type=["wav", "mp3", "m4a", "flac", "ogg"])
-    if uploaded:
-        ext = Path(uploaded.name).suffix.lower()
-        uid = str(uuid.uuid4())
-        dest = UPLOADS / f"{uid}{ext}"
-        with open(dest, "wb") as f:
-            f.write(uploaded.getbuffer())
-        audio_path = dest
+    uploads = st.file_uploader(
+        "Upload audio (WAV/MP3/etc.)", type=["wav", "mp3", "m4a", "flac", "ogg"], accept_multiple_files=True
+    )
+    for uploaded in uploads or []:
+        # one uid per uploaded file (file_id is new for every upload, even of a file with
+        # the same name and size); the decoded audio is named by the upload's content
+        # hash, so the same file is only decoded once across sessions
+        upload_key = f"upload_{uploaded.file_id}"
+        if upload_key not in st.session_state:
+            digest = hashlib.blake2b(uploaded.getbuffer(), digest_size=16).hexdigest()
+            st.session_state[upload_key] = (secrets.token_hex(8), digest)
+        uid, digest = st.session_state[upload_key]
+        suffix = Path(uploaded.name).suffix.lower()
+        native = UPLOADS / f"{digest}{suffix}"
+        dest = native if native.exists() else UPLOADS / f"{digest}.wav"
+        try:
+            if not dest.exists():
+                # stream the upload to disk in 1 MiB chunks rather than materializing it;
+                # a seekable file also lets ffmpeg read M4A/MP4 whose index sits at the end
+                raw = UPLOADS / f"{uid}_upload{suffix}"
+                with open(raw, "wb") as f:
+                    shutil.copyfileobj(uploaded, f, length=1 << 20)
+                try:
+                    # files libsndfile can decode are fed to the model as uploaded
+                    # (load_audio downmixes/resamples); the rest go through ffmpeg
+                    if soundfile_readable(raw):
+                        dest = raw.replace(native)
+                    else:
+                        # decode under a private name and move into place, so another
+                        # session never reads a half-written file
+                        tmp = UPLOADS / f"{uid}_decode.wav"
+                        ffmpeg_to_wav(raw, tmp)
+                        tmp.replace(dest)
+                finally:
+                    raw.unlink(missing_ok=True)
+            clips.append((dest, uid, uploaded.name))
+        except Exception as e:
+            st.error(f"❌ Error decoding {uploaded.name}: {e}")
 
 elif input_type == "YouTube Link":
     url = st.text_input("Paste YouTube link here")
     if st.button("Download and Convert") and url:
-        uid = str(uuid.uuid4())
-        try:
-            st.info("Downloading from YouTube...")
-            ydl_opts = {
-                "format": "bestaudio/best",
-                "outtmpl": str(UPLOADS / f"{uid}.%(ext)s"),
-                "quiet": True,
-                "no_warnings": True,
-                "postprocessors": [
-                    {"key": "FFmpegExtractAudio", "preferredcodec": "mp3", "preferredquality": "192"}
-                ],
-            }
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
-                raw_fname = ydl.prepare_filename(info)
-                if not raw_fname.lower().endswith(".mp3"):
-                    raw_fname = str(Path(raw_fname).with_suffix(".mp3"))
-                audio_raw = Path(raw_fname)
-                if not audio_raw.exists():
-                    raise FileNotFoundError(f"Expected downloaded file {audio_raw} missing")
-            st.success("✅ Downloaded. Trimming to first 30 seconds...")
-            audio = AudioSegment.from_file(audio_raw)
-            trimmed = audio[:30 * 1000]
-            trimmed_path = UPLOADS / f"{uid}_trimmed.wav"
-            trimmed.export(trimmed_path, format="wav")
-            audio_path = trimmed_path
+        uid = secrets.token_hex(8)
+        # the clip is cached by URL: a repeat request skips extraction and download
+        cached = UPLOADS / f"yt_{hashlib.blake2b(url.strip().encode(), digest_size=16).hexdigest()}.wav"
+        if cached.exists():
+            clips.append((cached, uid, url))
+        else:
             try:
-                audio_raw.unlink()
-            except Exception:
-                pass
+                st.info("Downloading from YouTube...")
+                trimmed_path = UPLOADS / f"{uid}_trimmed.wav"
+                with make_ydl(uid) as ydl:
+                    info = ydl.extract_info(url, download=False)
+                    if info.get("protocol") in ("http", "https", "m3u8", "m3u8_native"):
+                        # plain HTTP/HLS stream: ffmpeg fetches and decodes the first
+                        # CLIP_SECONDS in one pass, so decoding overlaps the download
+                        ffmpeg_to_wav(info["url"], trimmed_path, start=0, duration=CLIP_SECONDS, headers=info.get("http_headers"))
+                    else:
+                        info = ydl.process_ie_result(info, download=True)
+                        audio_raw = Path(info["requested_downloads"][0]["filepath"])
+                        if not audio_raw.exists():
+                            raise FileNotFoundError(f"Expected downloaded file {audio_raw} missing")
+                        st.success(f"✅ Downloaded. Trimming to first {CLIP_SECONDS} seconds...")
+                        try:
+                            ffmpeg_to_wav(audio_raw, trimmed_path, start=0, duration=CLIP_SECONDS)
+                        finally:
+                            audio_raw.unlink(missing_ok=True)
+                clips.append((trimmed_path.replace(cached), uid, info.get("title") or url))
+            except Exception as e:
+                st.error(f"❌ Error downloading audio: {e}")
+
+# MusicXML (and PDF, when MuseScore is installed) for one transcription, written next to
+# the MIDI. A MuseScore failure is returned rather than raised so the MusicXML still counts
+def render_sheet(midi_digest: str, advanced_layout: bool, midi_out: Path, note_events: list, musicxml_path: Path, pdf_path: Path):
+    version = cache_version("music21") if advanced_layout else cache_version()
+    xml_bytes = midi_to_musicxml(midi_digest, advanced_layout, version, str(midi_out), note_events)
+    musicxml_path.write_bytes(xml_bytes)
+    if MUSESCORE:
+        try:
+            xml_digest = hashlib.blake2b(xml_bytes, digest_size=16).hexdigest()
+            pdf_path.write_bytes(musicxml_to_pdf(xml_digest, cache_version(), str(musicxml_path)))
         except Exception as e:
-            st.error(f"❌ Error downloading audio: {e}")
-            audio_path = None
+            return e
+    return None
+
+
+# Submit once per audio content; later reruns (or the same audio under another name)
+# pick the same future back up
+def submit_transcription(audio_path: Path, coreml_units: str = "ALL"):
+    audio_digest = file_digest(audio_path)
+    job_key = f"predict_{audio_digest}_{coreml_units}"
+    fut = st.session_state.get(job_key)
+    if fut is None:
+        fut = st.session_state[job_key] = get_executor().submit(
+            run_basic_pitch,
+            audio_digest,
+            QUANTIZE_MODEL,
+            cache_version("basic-pitch", "onnxruntime"),
+            DEVICE,
+            coreml_units,
+            str(audio_path),
+        )
+    return job_key, fut
+
 
-if audio_path:
+# Processing + downloads run as a fragment: clicking a download button reruns only
+# this section, not the whole script (inputs, decoding, model/cache lookups)
+@st.fragment
+def process_and_download(audio_path: Path, uid: str, coreml_units: str):
     st.success("✅ Audio ready. Generating sheet music...")
+    advanced_layout = st.toggle("Advanced score layout (music21, slower)", value=False, key=f"advanced_{uid}")
+    export_json = st.toggle("Also export note events as JSON", value=False, key=f"json_{uid}")
+    if advanced_layout:
+        get_music21_worker()  # start importing music21 while transcription runs
 
-    uid = audio_path.stem.split("_")[0]
     midi_out = OUTPUTS / f"{uid}.midi"
     musicxml_path = OUTPUTS / f"{uid}.musicxml"
     note_events_json = OUTPUTS / f"{uid}_note_events.json"
+    note_events_feather = OUTPUTS / f"{uid}_note_events.feather"
+    pdf_path = OUTPUTS / f"{uid}.pdf"
+    sheet_key = f"sheet_{uid}"
+    sheet = None  # future for the MusicXML/PDF rendering
 
-    if IMPORT_ERROR and not (PREDICT_FN or PREDICT_AND_SAVE_FN):
-        st.error(f"Failed to import basic-pitch: {IMPORT_ERROR}")
+    _, import_error = load_basic_pitch()
+    if import_error:
+        st.error(f"Failed to import basic-pitch: {import_error}")
         st.info(
             "basic-pitch needs a model backend. On macOS install CoreML support: "
             "`pip install 'basic-pitch[coreml]'`. Alternatively use TensorFlow backend with "
@@ -129,26 +837,27 @@ if audio_path:
         )
     else:
         try:
-            if PREDICT_AND_SAVE_FN:
-                # attempt with common signature
-                PREDICT_AND_SAVE_FN(str(audio_path), str(midi_out), str(note_events_json), None)
-                st.success("🎼 MIDI generated via predict_and_save().")
-            elif PREDICT_FN:
-                result = PREDICT_FN(str(audio_path), None)
-                if isinstance(result, tuple) and len(result) >= 3:
-                    _, midi_data, note_events = result[0], result[1], result[2]
-                else:
-                    model_output, midi_data, note_events = result  # fallback
-                if hasattr(midi_data, "write"):
-                    midi_data.write(str(midi_out))
-                else:
-                    with open(midi_out, "wb") as f:
-                        f.write(midi_data)
-                with open(note_events_json, "w") as f:
-                    json.dump(sanitize(note_events), f, indent=2)
-                st.success("🎼 MIDI generated via predict().")
-            else:
-                raise RuntimeError("No usable basic-pitch entry point available.")
+            job_key, fut = submit_transcription(audio_path, coreml_units)
+            fresh = not fut.done()
+            if fresh:
+                # only block the fragment while the job is actually running
+                with st.status("Transcribing audio with basic-pitch...") as status:
+                    started = time.monotonic()
+                    while not fut.done():
+                        time.sleep(0.25)
+                        status.update(label=f"Transcribing audio with basic-pitch... {time.monotonic() - started:.0f}s")
+                    status.update(label="Transcription finished", state="complete")
+            try:
+                midi_bytes, note_events = fut.result()
+            except Exception:
+                del st.session_state[job_key]  # allow a retry on the next run
+                raise
+            if fresh or not midi_out.exists():
+                midi_out.write_bytes(midi_bytes)
+                write_note_events_feather(note_events, note_events_feather)
+            if export_json and not note_events_json.exists():
+                note_events_json.write_bytes(orjson.dumps(note_events, option=JSON_OPTS))
+            st.success("🎼 MIDI generated.")
         except Exception as e:
             st.error(f"❌ Error generating MIDI / prediction: {e}")
             st.info(
@@ -158,35 +867,84 @@ if audio_path:
             midi_out = None
 
         if midi_out and midi_out.exists():
-            try:
-                score = converter.parse(str(midi_out))
-                score.write("musicxml", fp=str(musicxml_path))
-                st.success("✅ Sheet music exported as MusicXML.")
-            except Exception as e:
-                st.error(f"❌ Error converting MIDI to MusicXML: {e}")
-                musicxml_path = None
+            # engrave off the script thread so the MIDI downloads below show up right away.
+            # Reruns (e.g. download clicks) reuse the last render unless the MIDI or the
+            # layout changed, so the score files aren't rewritten and re-read every time
+            midi_digest = hashlib.blake2b(midi_bytes, digest_size=16).hexdigest()
+            rendered = st.session_state.get(sheet_key)
+            stale = rendered is None or rendered[0] != (midi_digest, advanced_layout)
+            if stale or (rendered[1].done() and not musicxml_path.exists()):
+                rendered = st.session_state[sheet_key] = (
+                    (midi_digest, advanced_layout),
+                    get_render_executor().submit(
+                        render_sheet, midi_digest, advanced_layout, midi_out, note_events, musicxml_path, pdf_path
+                    ),
+                )
+            sheet = rendered[1]
+    sheet_status = st.empty()
 
     # Downloads
     st.subheader("Downloads")
-    cols = st.columns(4)
+    cols = st.columns(6)
     if audio_path.exists():
         with cols[0]:
-            st.download_button("Download trimmed audio", data=open(audio_path, "rb"), file_name=audio_path.name, mime="audio/wav")
+            st.download_button("Download audio", data=download_data(audio_path, uid), file_name=audio_path.name, mime=mimetypes.guess_type(audio_path.name)[0] or "application/octet-stream", key=f"dl_{uid}_audio")
     if midi_out and midi_out.exists():
         with cols[1]:
-            st.download_button("Download MIDI", data=open(midi_out, "rb"), file_name=midi_out.name, mime="audio/midi")
+            st.download_button("Download MIDI", data=download_data(midi_out, uid), file_name=midi_out.name, mime="audio/midi", key=f"dl_{uid}_midi")
+    if note_events_feather.exists():
+        with cols[3]:
+            st.download_button("Download note events (Feather)", data=download_data(note_events_feather, uid), file_name=note_events_feather.name, mime="application/vnd.apache.arrow.file", key=f"dl_{uid}_feather")
+    if export_json and note_events_json.exists():
+        with cols[4]:
+            st.download_button("Download note events (JSON)", data=download_data(note_events_json, uid), file_name=note_events_json.name, mime="application/json", key=f"dl_{uid}_json")
+
+    if sheet is not None:
+        with sheet_status.container():
+            try:
+                if not sheet.done():
+                    with st.spinner("Engraving sheet music..."):
+                        sheet.result()
+                pdf_error = sheet.result()
+                st.success("✅ Sheet music exported as MusicXML.")
+                if pdf_error:
+                    st.error(f"❌ Error rendering PDF with MuseScore: {pdf_error}")
+            except Exception as e:
+                del st.session_state[sheet_key]  # allow a retry on the next run
+                st.error(f"❌ Error converting MIDI to MusicXML: {e}")
+                musicxml_path = None
     if musicxml_path and musicxml_path.exists():
         with cols[2]:
-            st.download_button("Download MusicXML", data=open(musicxml_path, "rb"), file_name=musicxml_path.name, mime="application/xml")
-    if note_events_json.exists():
-        with cols[3]:
-            st.download_button("Download note events (JSON)", data=open(note_events_json, "rb"), file_name=note_events_json.name, mime="application/json")
+            st.download_button("Download MusicXML", data=download_data(musicxml_path, uid), file_name=musicxml_path.name, mime="application/xml", key=f"dl_{uid}_musicxml")
+    if MUSESCORE and pdf_path.exists():
+        with cols[5]:
+            st.download_button("Download PDF", data=download_data(pdf_path, uid), file_name=pdf_path.name, mime="application/pdf", key=f"dl_{uid}_pdf")
 
-    st.markdown(
-        """
+    if not MUSESCORE:
+        st.markdown(
+            """
 **Next steps / notes:**  
-- To get **PDF sheet music**, open the `.musicxml` in MuseScore or via CLI:  
+- To get **PDF sheet music**, open the `.musicxml` in MuseScore or via CLI
+  (with MuseScore on the server's PATH the app renders the PDF itself):  
 ```sh
 musescore score.musicxml -o sheet.pdf
-        """
-    )
+            """
+        )
+
+
+# queue every clip before rendering any of them, so the executor transcribes them
+# concurrently instead of one fragment at a time
+if load_basic_pitch()[1] is None:
+    for audio_path, _, _ in clips:
+        submit_transcription(audio_path, coreml_units)
+for audio_path, uid, name in clips:
+    if len(clips) > 1:
+        st.header(name)
+    process_and_download(audio_path, uid, coreml_units)
+
+# forget the download payloads of clips that are no longer on the page
+shown = {uid for _, uid, _ in clips}
+download_bytes = st.session_state.get("download_bytes", {})
+for uid in list(download_bytes):
+    if uid not in shown:
+        del download_bytes[uid]
@@ -0,0 +1,63 @@
+"""One-shot build of the int8 basic-pitch model the app loads with PIANO_QUANTIZE=1.
+
+Produces, in artifacts/ (or --out-dir):
+  basic_pitch.int8.onnx      dynamically quantized (int8 weights) model
+  basic_pitch.int8.opt.onnx  the same graph with ORT's portable fusions applied
+
+Run once (e.g. in the image build) so app starts skip conversion, quantization
+and the graph optimization pass:
+
+    python scripts/export_basic_pitch_onnx.py
+"""
+import argparse
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+
+def source_onnx(tmp: Path) -> Path:
+    from basic_pitch import FilenameSuffix, build_icassp_2022_model_path
+
+    # basic-pitch >= 0.3 bundles an ONNX export; older installs only have the SavedModel
+    onnx_path = build_icassp_2022_model_path(FilenameSuffix.onnx)
+    if onnx_path.exists():
+        return onnx_path
+    out = tmp / "nmp.onnx"
+    saved_model = build_icassp_2022_model_path(FilenameSuffix.tf)
+    subprocess.run(
+        [sys.executable, "-m", "tf2onnx.convert", "--saved-model", str(saved_model), "--output", str(out), "--opset", "17"],
+        check=True,
+    )
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--out-dir", type=Path, default=Path("artifacts"))
+    args = parser.parse_args()
+
+    import onnxruntime as ort
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    args.out_dir.mkdir(parents=True, exist_ok=True)
+    q_path = args.out_dir / "basic_pitch.int8.onnx"
+    opt_path = args.out_dir / "basic_pitch.int8.opt.onnx"
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        fp32 = source_onnx(tmp)
+        # shape inference + basic folding first, as recommended before quantization
+        prepped = tmp / "nmp.prepped.onnx"
+        quant_pre_process(str(fp32), str(prepped))
+        quantize_dynamic(str(prepped), str(q_path), per_channel=True, weight_type=QuantType.QInt8)
+
+    so = ort.SessionOptions()
+    so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+    so.optimized_model_filepath = str(opt_path)
+    ort.InferenceSession(str(q_path), sess_options=so, providers=["CPUExecutionProvider"])
+    print(f"wrote {q_path} and {opt_path}")
+
+
+if __name__ == "__main__":
+    main()